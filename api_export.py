@@ -0,0 +1,215 @@
+# api_export.py
+# Servicio HTTP de solo lectura que expone el último snapshot de AURA (df_resumen).
+# No ejecuta el ETL: sólo lee lo que dejó la app (o su refresco en segundo plano) en disco.
+#
+# Uso:
+#   python api_export.py --port 8502
+#
+# Endpoints:
+#   GET /resumen?format=json|csv&client=A,B&Region=LATAM&Vertical=Retail&cols=Client,Estado_AURA
+#   GET /version
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from modules.config import COLS_SEGMENTACION
+from modules.logic import textos_alertas
+from modules.snapshot import cargar_snapshot, marca_snapshot
+
+FORMATOS = {'json': 'application/json; charset=utf-8', 'csv': 'text/csv; charset=utf-8'}
+MAX_RESPUESTAS_CACHE = 256
+
+
+class EstadoExport:
+    """Snapshot en memoria + cache de respuestas ya serializadas, invalidado por versión."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snap = None
+        self.respuestas = {}
+
+    def obtener_snapshot(self):
+        marca = marca_snapshot()
+        with self.lock:
+            if marca is not None and (self.snap is None or self.snap['marca'] != marca):
+                nuevo = cargar_snapshot()
+                if nuevo is not None:
+                    if self.snap is None or nuevo['version'] != self.snap['version']:
+                        self.respuestas = {}
+                    self.snap = nuevo
+            return self.snap
+
+    def obtener_respuesta(self, clave, construir):
+        with self.lock:
+            if clave in self.respuestas:
+                return self.respuestas[clave]
+        cuerpo = construir()
+        with self.lock:
+            if len(self.respuestas) >= MAX_RESPUESTAS_CACHE:
+                self.respuestas.pop(next(iter(self.respuestas)))
+            self.respuestas[clave] = cuerpo
+        return cuerpo
+
+
+ESTADO = EstadoExport()
+
+
+COL_ALERTAS = 'Alertas_Detalle'  # Columna virtual: se arma desde la tabla de alertas al exportar
+# Columnas de uso interno del ETL: no salen por defecto (sí si se piden explícitamente en 'cols')
+COLS_INTERNAS = ['Date', 'Estado_Cod']
+PREFIJOS_INTERNOS = ('Anom_', 'Pendiente_')
+
+
+def es_interna(col):
+    return col in COLS_INTERNAS or str(col).startswith(PREFIJOS_INTERNOS)
+
+
+def filtrar_resumen(df_resumen, params):
+    """Aplica filtros de cliente, segmento (Region/Vertical/Año/Tipo) y columnas."""
+    df = df_resumen
+    mascara = None
+
+    clientes = [c.strip() for v in params.get('client', []) for c in v.split(',') if c.strip()]
+    if clientes:
+        mascara = df['Client'].isin(clientes)
+
+    for col in df.columns:
+        if str(col).lower() not in COLS_SEGMENTACION:
+            continue
+        valores = [x.strip() for k, vs in params.items() if k.lower() == str(col).lower() for v in vs for x in v.split(',')]
+        if valores:
+            m = df[col].astype(str).isin(valores)
+            mascara = m if mascara is None else (mascara & m)
+
+    if mascara is not None:
+        df = df[mascara]
+
+    cols = [c.strip() for v in params.get('cols', []) for c in v.split(',') if c.strip()]
+    if cols:
+        faltantes = [c for c in cols if c not in df.columns and c != COL_ALERTAS]
+        if faltantes:
+            raise ValueError(f"Columnas inexistentes: {', '.join(faltantes)}")
+        df = df[[c for c in cols if c != COL_ALERTAS] + (['Client'] if 'Client' not in cols else [])]
+    else:
+        df = df[[c for c in df.columns if not es_interna(c)]]
+    return df, (not cols or COL_ALERTAS in cols), (not cols or 'Client' in cols)
+
+
+def serializar(df, df_alertas, formato, con_alertas=True, con_cliente=True):
+    df = df.copy()
+    if con_alertas:
+        textos = textos_alertas(df_alertas, df['Client'])
+        if formato == 'csv':
+            df[COL_ALERTAS] = [' | '.join(textos.get(c, [])) for c in df['Client']]
+        else:
+            df[COL_ALERTAS] = [textos.get(c, []) for c in df['Client']]
+    if not con_cliente:
+        df = df.drop(columns='Client')
+    if formato == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    return df.to_json(orient='records', force_ascii=False, date_format='iso').encode('utf-8')
+
+
+def acepta_gzip(accept_encoding):
+    """True si el cliente acepta gzip con q > 0 (respeta 'gzip;q=0' y el comodín '*')."""
+    calidades = {}
+    for parte in accept_encoding.split(','):
+        codigo, _, resto = parte.partition(';')
+        codigo = codigo.strip().lower()
+        if not codigo:
+            continue
+        q = 1.0
+        for param in resto.split(';'):
+            nombre, _, valor = param.partition('=')
+            if nombre.strip().lower() == 'q':
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        calidades[codigo] = q
+    return calidades.get('gzip', calidades.get('*', 0.0)) > 0
+
+
+def clave_consulta(params):
+    """Forma canónica de los parámetros (el orden en la URL no cambia el ETag)."""
+    normal = sorted((k, ','.join(sorted(vs))) for k, vs in params.items())
+    return hashlib.sha1(json.dumps(normal, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    server_version = "AURAExport/1.0"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        snap = ESTADO.obtener_snapshot()
+        if snap is None:
+            return self.responder_error(503, "Todavía no hay snapshot disponible.")
+
+        if url.path == '/version':
+            cuerpo = json.dumps({'version': snap['version'], 'generado': snap['generado'].isoformat()}).encode('utf-8')
+            return self.responder(200, cuerpo, FORMATOS['json'])
+
+        if url.path != '/resumen':
+            return self.responder_error(404, "Ruta no encontrada. Usa /resumen o /version.")
+
+        formato = params.pop('format', ['json'])[0].lower()
+        if formato not in FORMATOS:
+            return self.responder_error(400, f"Formato no soportado: {formato}")
+
+        # gzip e identidad son representaciones distintas: cada una con su propio ETag
+        usa_gzip = acepta_gzip(self.headers.get('Accept-Encoding', ''))
+        etag = f'"{snap["version"]}-{formato}-{clave_consulta(params)}{"-gz" if usa_gzip else ""}"'
+        if etag in [e.strip() for e in self.headers.get('If-None-Match', '').split(',')]:
+            return self.responder(304, b'', FORMATOS[formato], etag=etag)
+
+        def construir():
+            df, con_alertas, con_cliente = filtrar_resumen(snap['resumen'], params)
+            cuerpo = serializar(df, snap['alertas'], formato, con_alertas, con_cliente)
+            return gzip.compress(cuerpo, compresslevel=6) if usa_gzip else cuerpo
+
+        try:
+            cuerpo = ESTADO.obtener_respuesta(etag, construir)
+        except ValueError as e:
+            return self.responder_error(400, str(e))
+        self.responder(200, cuerpo, FORMATOS[formato], etag=etag, gzip_ok=usa_gzip)
+
+    def responder(self, codigo, cuerpo, content_type, etag=None, gzip_ok=False):
+        self.send_response(codigo)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        if etag: self.send_header('ETag', etag)
+        if gzip_ok: self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo: self.wfile.write(cuerpo)
+
+    def responder_error(self, codigo, mensaje):
+        cuerpo = json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8')
+        self.responder(codigo, cuerpo, FORMATOS['json'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportador HTTP de solo lectura del snapshot AURA.")
+    # Sin autenticación: por defecto sólo local. Usar --host 0.0.0.0 únicamente detrás de un proxy con acceso controlado.
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args()
+
+    servidor = ThreadingHTTPServer((args.host, args.port), ExportHandler)
+    print(f"AURA export escuchando en http://{args.host}:{args.port}/resumen")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,13 @@
 # app.py
+import threading
+from datetime import datetime
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from modules.config import CONFIG_HOJAS
-from modules.data import cargar_todo_aura
-from modules.logic import evaluar_cumplimiento_dinamico
+from modules.config import CONFIG_HOJAS, COLS_SEGMENTACION, REFRESCO_TTL, SNAPSHOT_VIEJO_HORAS
+from modules.logic import (evaluar_cumplimiento_dinamico, texto_percentil_cohortes, texto_proyeccion, textos_alertas,
+                           ETIQUETAS_ANOMALIA, ANOM_ATIPICO, ESTADO_CRITICO, ESTADO_REVISION, ESTADO_ATENCION, ESTADO_SALUDABLE)
+from modules.snapshot import cargar_snapshot, marca_snapshot, formatear_antiguedad
+# plotly y el ETL (modules.data) se importan recién cuando una vista / refresco los necesita.
 
 # --- CONFIGURACIÓN INICIAL ---
 st.set_page_config(page_title="AURA - Dashboard Integral", page_icon="🧬", layout="wide")
@@ -19,6 +22,41 @@ if 'kpi_selected' not in st.session_state:
 def set_view(view_name):
     st.session_state.view = view_name
 
+# --- ARRANQUE EN CALIENTE (Snapshot Local + Refresco en Segundo Plano) ---
+@st.cache_resource(ttl=REFRESCO_TTL)
+def lanzar_refresco_background():
+    """Un solo hilo de refresco por proceso cada REFRESCO_TTL segundos."""
+    def _trabajo():
+        try:
+            from modules.data import refrescar_snapshot
+            version, log = refrescar_snapshot()
+            estado['error'] = None if version else log
+        except Exception as e:
+            estado['error'] = f"Error inesperado en el refresco: {e}"
+
+    estado = {'error': None}
+    hilo = threading.Thread(target=_trabajo, name="aura-refresco", daemon=True)
+    hilo.start()
+    estado['hilo'] = hilo
+    return estado
+
+def sincronizar_snapshot():
+    """Carga el snapshot de disco en la sesión sólo si hay uno más nuevo que el actual."""
+    marca = marca_snapshot()
+    if marca is None or marca == st.session_state.get('snapshot_marca'):
+        return
+    snap = cargar_snapshot()
+    if snap is None:
+        return
+    st.session_state['hist'] = snap['hist']
+    st.session_state['resumen'] = snap['resumen']
+    st.session_state['alertas'] = snap['alertas']
+    st.session_state['snapshot_marca'] = snap['marca']
+    st.session_state['snapshot_generado'] = snap['generado']
+
+sincronizar_snapshot()
+refresco = lanzar_refresco_background()
+
 # --- CSS PERSONALIZADO ---
 st.markdown("""
     <style>
@@ -83,12 +121,39 @@ for i, opcion in enumerate(opciones):
 
 st.divider()
 
-if st.button('🔄 Recargar Datos'):
+@st.fragment(run_every=5)
+def vigilar_refresco():
+    """Mientras el hilo trabaja, revisa si ya dejó un snapshot nuevo (o terminó) y recarga la app."""
+    if not refresco['hilo'].is_alive() or marca_snapshot() != st.session_state.get('snapshot_marca'):
+        st.rerun()
+
+col_edad, col_btn_recarga = st.columns([4, 1])
+with col_edad:
+    generado = st.session_state.get('snapshot_generado')
+    actualizando = refresco['hilo'].is_alive()
+    if generado is None:
+        if actualizando: st.info("⏳ Cargando datos por primera vez en segundo plano...")
+        elif refresco['error']: st.error(refresco['error'])
+    else:
+        texto_edad = f"🕒 Datos del {generado:%d/%m/%Y %H:%M} ({formatear_antiguedad(generado)})"
+        if actualizando: texto_edad += " · 🔄 Actualizando en segundo plano..."
+        if (datetime.now() - generado).total_seconds() > SNAPSHOT_VIEJO_HORAS * 3600:
+            st.warning(f"{texto_edad} · ⚠️ Datos desactualizados")
+        else:
+            st.caption(texto_edad)
+        if refresco['error'] and not actualizando:
+            st.caption(f"⚠️ Último refresco fallido: {refresco['error']}")
+    if actualizando: vigilar_refresco()
+
+if col_btn_recarga.button('🔄 Recargar Datos'):
     with st.spinner('Conectando con la nube...'):
-        hist, resumen, logs = cargar_todo_aura()
-        if hist is not None:
-            st.session_state['hist'] = hist
-            st.session_state['resumen'] = resumen
+        from modules.data import refrescar_snapshot
+        try:
+            version, logs = refrescar_snapshot()
+        except Exception as e:
+            version, logs = None, f"Error inesperado: {e}"
+        if version:
+            sincronizar_snapshot()
             st.success("¡Datos actualizados!")
         else:
             st.error(logs)
@@ -97,15 +162,17 @@ if st.button('🔄 Recargar Datos'):
 if 'resumen' in st.session_state:
     df_resumen = st.session_state['resumen']
     df_hist = st.session_state['hist']
+    df_alertas = st.session_state['alertas']
 
     # 1. VISIÓN GLOBAL
     if st.session_state.view == "📈 Visión Global":
+        import plotly.express as px
         st.header("🌍 Estado Operativo de la Cartera")
         
         total_clientes = len(df_resumen)
         total_trx = df_resumen['Transacciones'].sum()
         
-        df_criticos = df_resumen[df_resumen['Estado_AURA'].str.contains("Crítico")]
+        df_criticos = df_resumen[df_resumen['Estado_Cod'] == ESTADO_CRITICO]
         n_criticos = len(df_criticos)
         pct_criticos = n_criticos / total_clientes if total_clientes > 0 else 0
         riesgo_volumen = df_criticos['Transacciones'].sum()
@@ -121,21 +188,21 @@ if 'resumen' in st.session_state:
         st.divider()
 
         st.subheader("📊 Análisis por Segmento")
-        cols_segmentacion = [c for c in df_resumen.columns if c in ['Region', 'Vertical', 'Año', 'Tipo', 'region', 'vertical', 'año', 'tipo']]
+        cols_segmentacion = [c for c in df_resumen.columns if c in COLS_SEGMENTACION]
         if cols_segmentacion:
             segmento = st.selectbox("Selecciona Dimensión para Analizar:", cols_segmentacion)
             sg1, sg2 = st.columns(2)
             color_map_health = {'Saludable / Campeón 🏆': '#09AB3B', 'Atención Operativa': '#FFD700', 'Revisión Profunda': '#FFA500', 'Crítico / Riesgo': '#FF4B4B'}
             with sg1:
                 st.markdown(f"**Distribución de Riesgo por {segmento}**")
-                df_seg_count = df_resumen.groupby([segmento, 'Estado_AURA']).size().reset_index(name='Clientes')
+                df_seg_count = df_resumen.groupby([segmento, 'Estado_AURA'], observed=True).size().reset_index(name='Clientes')
                 fig_seg_risk = px.bar(df_seg_count, x=segmento, y='Clientes', color='Estado_AURA', color_discrete_map=color_map_health, barmode='stack')
                 st.plotly_chart(fig_seg_risk, use_container_width=True)
             with sg2:
                 metric_y = 'MRR' if ('MRR' in df_resumen.columns and df_resumen['MRR'].sum() > 0) else 'Transacciones'
                 lbl = "Económico (MRR)" if metric_y == 'MRR' else "Operativo (Volumen)"
                 st.markdown(f"**Impacto {lbl} por {segmento}**")
-                df_seg_val = df_resumen.groupby([segmento, 'Estado_AURA'])[metric_y].sum().reset_index()
+                df_seg_val = df_resumen.groupby([segmento, 'Estado_AURA'], observed=True)[metric_y].sum().reset_index()
                 fig_seg_val = px.bar(df_seg_val, x=segmento, y=metric_y, color='Estado_AURA', color_discrete_map=color_map_health)
                 st.plotly_chart(fig_seg_val, use_container_width=True)
         else:
@@ -146,10 +213,10 @@ if 'resumen' in st.session_state:
         st.header("🧠 Diagnóstico Estratégico")
         fases_activas = ["On Going ✅", "Deployment 🚀", "Adopción 🌱"]
         df_activos = df_resumen[df_resumen['Fase_Vida'].str.contains('|'.join([x.split(' ')[0] for x in fases_activas]), case=False, na=False)]
-        criticos = df_activos[df_activos['Estado_AURA'].str.contains("Crítico")]
-        revision = df_activos[df_activos['Estado_AURA'].str.contains("Revisión")]
-        atencion = df_activos[df_activos['Estado_AURA'].str.contains("Atención")]
-        saludables = df_activos[df_activos['Estado_AURA'].str.contains("Saludable")]
+        criticos = df_activos[df_activos['Estado_Cod'] == ESTADO_CRITICO]
+        revision = df_activos[df_activos['Estado_Cod'] == ESTADO_REVISION]
+        atencion = df_activos[df_activos['Estado_Cod'] == ESTADO_ATENCION]
+        saludables = df_activos[df_activos['Estado_Cod'] == ESTADO_SALUDABLE]
 
         c1, c2, c3, c4 = st.columns(4)
         c1.metric("🚨 Riesgo Crítico", len(criticos))
@@ -167,14 +234,16 @@ if 'resumen' in st.session_state:
                     if alert_type == "success": 
                         st.dataframe(df[['Client', 'Fase_Vida']], hide_index=True, use_container_width=True)
                     else:
+                        # El texto de las alertas se arma sólo para los clientes de esta lista
+                        textos = textos_alertas(df_alertas, df['Client'])
                         for index, row in df.iterrows():
                             with st.expander(f"{row['Client']}"):
                                 if alert_type == "error": st.error(f"**Estado:** {row['Fase_Vida']}")
-                                elif alert_type == "warning": st.warning(f"**Alertas:** {len(row['Alertas_Detalle'])}")
+                                elif alert_type == "warning": st.warning(f"**Alertas:** {row['N_Alertas']}")
                                 else: st.info("Detalles:")
                                 if row.get('Motivo_Critico'): st.markdown(f"**Causa:** {row['Motivo_Critico']}")
                                 st.markdown("---")
-                                for alerta in row['Alertas_Detalle']: st.markdown(f"- {alerta}")
+                                for alerta in textos.get(row['Client'], []): st.markdown(f"- {alerta}")
 
         col_names = {"error": "🚨 Críticos", "warning": "🟠 Revisión", "info": "⚠️ Atención", "success": "🏆 Saludables"}
         render_list(col_crit, criticos, "Limpio.", "error")
@@ -184,6 +253,7 @@ if 'resumen' in st.session_state:
 
     # 3. AUDITORÍA
     elif st.session_state.view == "🎯 Auditoría":
+        import plotly.express as px
         clientes = sorted(df_resumen['Client'].unique())
         idx_sel = 0
         if 'last_client' in st.session_state and st.session_state.last_client in clientes:
@@ -194,7 +264,7 @@ if 'resumen' in st.session_state:
         if cliente_sel:
             row = df_resumen[df_resumen['Client'] == cliente_sel].iloc[0]
             historia_cli = df_hist[df_hist['Client'] == cliente_sel]
-            meta_info = []
+            meta_info = [f"{c}: **{row[c]}**" for c in df_resumen.columns if c in COLS_SEGMENTACION]
             meta_str = " | ".join(meta_info)
             if meta_str: meta_str = f" | {meta_str}"
             st.info(f"Estado: **{row['Fase_Vida']}** | AURA Score: **{row['Estado_AURA']}**{meta_str}")
@@ -232,7 +302,9 @@ if 'resumen' in st.session_state:
                     elif not det_msg: det_msg = "&nbsp;"
 
                     item = {'key': key, 'cfg': cfg, 'prio': prio, 'val': row.get(cfg['kpi'], 0),
-                            'st_msg': st_msg, 'det_msg': det_msg, 'css_class': css_class}
+                            'st_msg': st_msg, 'det_msg': det_msg, 'css_class': css_class,
+                            'pares_msg': texto_percentil_cohortes(row, cfg['kpi']) if prio > 0 else "",
+                            'proy_msg': texto_proyeccion(row, cfg) if prio > 0 else ""}
 
                     if key in ['Transacciones', 'MRR']: kpis_vip.append(item)
                     else: kpis_grid.append(item)
@@ -259,6 +331,8 @@ if 'resumen' in st.session_state:
                                 
                                 col_txt, col_btn = st.columns([1, 1]) 
                                 st.caption(item['det_msg'])
+                                if item['pares_msg']: st.caption(f"👥 {item['pares_msg']}")
+                                if item['proy_msg']: st.caption(f"🔮 {item['proy_msg']}")
                                 if st.button("📊 Ver Tendencia", key=f"btn_{item['key']}", use_container_width=True):
                                     st.session_state.kpi_selected = item['key']
                                     st.rerun()
@@ -277,6 +351,8 @@ if 'resumen' in st.session_state:
                             st.markdown(render_card_html(item, val_str), unsafe_allow_html=True)
                             
                             st.caption(item['det_msg'])
+                            if item['pares_msg']: st.caption(f"👥 {item['pares_msg']}")
+                            if item['proy_msg']: st.caption(f"🔮 {item['proy_msg']}")
                             if st.button("📊 Ver", key=f"btn_{item['key']}", use_container_width=True):
                                 st.session_state.kpi_selected = item['key']
                                 st.rerun()
@@ -301,10 +377,21 @@ if 'resumen' in st.session_state:
                  )
                  
                  col_tecnica = CONFIG_HOJAS[kpi_grafico]['kpi']
-                 df_plot = df_hist[df_hist['Client'] == cliente_sel][['Date_Obj', col_tecnica]].set_index('Date_Obj').sort_index()
+                 col_anom = f"Anom_{col_tecnica}"
+                 cols_plot = ['Date_Obj', col_tecnica] + ([col_anom] if col_anom in df_hist.columns else [])
+                 df_plot = historia_cli[cols_plot].set_index('Date_Obj').sort_index()
                  
                  title_plot = f"Evolución de {kpi_grafico}"
                  fig = px.line(df_plot, y=col_tecnica, markers=True, title=title_plot)
+
+                 # Marcadores de anomalías detectadas
+                 if col_anom in df_plot.columns:
+                     for codigo, etiqueta in ETIQUETAS_ANOMALIA.items():
+                         puntos = df_plot[df_plot[col_anom] == codigo]
+                         if not puntos.empty:
+                             fig.add_scatter(x=puntos.index, y=puntos[col_tecnica], mode='markers', name=etiqueta,
+                                             marker=dict(size=13, symbol='x' if codigo == ANOM_ATIPICO else 'diamond',
+                                                         color='#FF4B4B' if codigo == ANOM_ATIPICO else '#FFA500'))
                  
                  # === AJUSTE DE ALTURA ===
                  # Igualamos la altura a 650px para coincidir con el contenedor de la izquierda
@@ -335,4 +422,4 @@ if 'resumen' in st.session_state:
                 st.write(", ".join(clientes_en_fase))
 
     elif st.session_state.view == "📂 Datos Maestros":
-        st.dataframe(df_hist.drop(columns=['Date_Obj']), use_container_width=True)
\ No newline at end of file
+        st.dataframe(df_hist.drop(columns=['Date_Obj'] + [c for c in df_hist.columns if c.startswith('Anom_')]), use_container_width=True)
\ No newline at end of file
@@ -1,9 +1,75 @@
 # modules/config.py
+import os
 
 # ID del Google Sheet
 SHEET_ID = "1UpA9zZ3MbBRmP6M9qOd7G8NGouCufY-dU1cJ-ZB1cdU"
 URL_EXPORT = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=xlsx"
 
+# --- SNAPSHOT LOCAL (Last-Known-Good) ---
+# Carpeta donde se guarda el último resultado válido del ETL para arrancar sin esperar a la nube.
+SNAPSHOT_DIR = os.environ.get('AURA_DATA_DIR', '.aura_cache')
+SNAPSHOT_FILE = 'snapshot_aura.pkl'
+REFRESCO_TTL = 600          # Segundos entre refrescos en segundo plano
+SNAPSHOT_VIEJO_HORAS = 24   # A partir de esta antigüedad se avisa que los datos están desactualizados
+
+# --- HISTORIA LOCAL (Append-Only) ---
+# Guarda cada mes (Client x KPI) en disco para no perder historia cuando se recorta el Google Sheet.
+USAR_HISTORIA_LOCAL = True
+HISTORIA_DIR = os.path.join(SNAPSHOT_DIR, 'historia')
+
+# --- GRANULARIDAD TEMPORAL ---
+# Frecuencia de las columnas de fecha en las hojas de KPIs: 'mensual', 'semanal' o 'diaria'.
+GRANULARIDAD = os.environ.get('AURA_GRANULARIDAD', 'mensual')
+# periodos_por_mes: Cuántos períodos equivalen a un mes (escala las ventanas pensadas en meses).
+# fmt:              Formato para mostrar un período en pantalla / alertas.
+CONFIG_GRANULARIDAD = {
+    'mensual': {'periodos_por_mes': 1, 'fmt': '%b-%Y'},
+    'semanal': {'periodos_por_mes': 52 / 12, 'fmt': 'Sem %d-%b-%Y'},
+    'diaria': {'periodos_por_mes': 365 / 12, 'fmt': '%d-%b-%Y'},
+}
+# Formatos aceptados en los encabezados de fecha de las hojas (se prueban en orden).
+# Semanas ISO ('2024-W05') se interpretan como el lunes de esa semana.
+FORMATOS_FECHA = ['%b-%Y', '%b-%y', '%B-%Y', '%Y-%m', '%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%G-W%V-%u']
+# Si True y la granularidad no es mensual, el ciclo de vida se calcula sobre la historia consolidada a meses.
+RESAMPLEAR_CICLO_VIDA = True
+
+# --- DIMENSIONES DE SEGMENTACIÓN ---
+# Columnas de la hoja 'Caracteristicas cliente' que se usan para agrupar (y comparar contra pares).
+COLS_SEGMENTACION = ['Region', 'Vertical', 'Año', 'Tipo', 'region', 'vertical', 'año', 'tipo']
+SIN_ASIGNAR = 'Sin Asignar'
+# Tamaño mínimo de una cohorte para mostrar percentil / mediana de pares (con menos, el percentil no dice nada).
+MIN_COHORTE = 5
+
+# --- DETECCIÓN DE ANOMALÍAS (Todas las series Cliente x KPI) ---
+# Calibrado sobre ruido sintético (Normal, Poisson, Lognormal; 24 períodos): ~0.2-0.7% de puntos
+# marcados como atípicos y <0.2% como cambio de nivel, es decir ~0.1 alertas 📍 por cliente sin señal real.
+# ventana:          Períodos previos usados como referencia (mediana / escala). Con menos historia no se evalúa.
+# z_umbral:         |z robusto| a partir del cual un punto es atípico.
+# escala_min_rel:   Piso de la escala como fracción de la mediana (evita z enormes en series casi planas).
+# nivel_antes:      Períodos de referencia antes de un posible cambio de nivel.
+# nivel_despues:    Períodos después del cambio que deben sostener el nuevo nivel.
+# nivel_sigmas:     Cuántos errores estándar debe superar el salto de medianas.
+# cambio_min:       Cambio relativo mínimo de la mediana para considerar cambio de nivel (0.3 = 30%).
+# periodos_alerta:  Sólo las anomalías de los últimos N períodos se agregan a Alertas_Detalle.
+CONFIG_ANOMALIAS = {
+    'ventana': 12,
+    'z_umbral': 4.5,
+    'escala_min_rel': 0.02,
+    'nivel_antes': 9,
+    'nivel_despues': 3,
+    'nivel_sigmas': 5,
+    'cambio_min': 0.30,
+    'periodos_alerta': 3,
+}
+
+# --- PROYECCIÓN PRÓXIMO PERÍODO ---
+# ventana:        Últimos N períodos usados para ajustar la recta (tendencia lineal).
+# amortiguacion:  Factor (0-1) que amortigua la pendiente al proyectar (1 = lineal puro).
+CONFIG_PROYECCION = {
+    'ventana': 6,
+    'amortiguacion': 0.8,
+}
+
 # --- CONFIGURACIÓN MAESTRA DE KPIs ---
 # Aquí definimos cómo se comporta cada indicador en AURA.
 #
@@ -15,6 +81,7 @@ URL_EXPORT = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=x
 # desc:         Texto amigable que ve el usuario en pantalla.
 # std:          Valor Estándar por defecto (si no hay Goal definido).
 # mayor_mejor:  True (Queremos que suba, ej: Ventas), False (Queremos que baje, ej: Cancelados).
+# agg:          Cómo se consolida a mes si las hojas vienen semanales/diarias ('sum', 'mean', 'last').
 
 CONFIG_HOJAS = {
     'Transacciones': {
@@ -24,7 +91,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Transacciones',
         'desc': 'Potencial de Crecimiento',
         'std': 0,          # Depende puramente de tendencia
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'sum'
     },
     'Tiendas': {
         'kpi': 'Tiendas_Activas', 
@@ -33,7 +101,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Tiendas',
         'desc': 'Rollout / Expansión',
         'std': 0,          # Depende del plan de expansión
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'last'
     },
     'Pedidos_Abiertos': {
         'kpi': 'Pedidos_Abiertos', 
@@ -42,7 +111,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Pedidos_Abiertos',
         'desc': 'Uso Correcto Plataforma',
         'std': 0.05,       # Menos del 5% es saludable
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     }, 
     'Asignacion_Pickers': {
         'kpi': 'Tasa_Asignacion_Pickers', 
@@ -51,7 +121,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Asignacion_Pickers',
         'desc': 'Automatización Picking',
         'std': 0.99,       # Menos del 10% manual
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     },
     'Asignacion_Drivers': {
         'kpi': 'Tasa_Asignacion_Drivers', 
@@ -60,7 +131,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Asignacion_Drivers',
         'desc': 'Automatización Delivery',
         'std': 0.99,       # Menos del 10% manual
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     },
     'Ontime': {
         'kpi': 'Tasa_Ontime', 
@@ -69,7 +141,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_Ontime',
         'desc': 'Puntualidad',
         'std': 0.80,       # Mínimo aceptable industria
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'mean'
     },
     'infull': {
         'kpi': 'Tasa_Infull', 
@@ -78,7 +151,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_infull',
         'desc': 'Completitud',
         'std': 0.95,       # Mínimo aceptable industria
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'mean'
     },
     'cancelados': {
         'kpi': 'Tasa_Cancelados', 
@@ -87,7 +161,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_cancelados',
         'desc': 'Fricción (Cancelados)',
         'std': 0.15,       # Máximo tolerable
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     },
     'reprogramados': {
         'kpi': 'Tasa_Reprogramados', 
@@ -96,7 +171,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_reprogramados',
         'desc': 'Fricción (Reprogramados)',
         'std': 0.15,       # Máximo tolerable
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     },
     
     'uph': {
@@ -106,7 +182,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_uph',
         'desc': 'Productividad / Velocidad',
         'std': 60,         # Unidades por Hora base
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'mean'
     },
     'DAC': {
         'kpi': 'DAC', 
@@ -115,7 +192,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_DAC',
         'desc': 'Satisfacción / Quejas',
         'std': 0.50,       # Tolerancia máxima de reclamos
-        'mayor_mejor': False
+        'mayor_mejor': False,
+        'agg': 'mean'
     },
     'CIHS': {
         'kpi': 'CIHS', 
@@ -124,7 +202,8 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_CIHS',
         'desc': 'Adherencia (Features)',
         'std': 10,         # Uso mínimo de funcionalidades
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'mean'
     },
     'MRR': {
         'kpi': 'MRR', 
@@ -133,6 +212,7 @@ CONFIG_HOJAS = {
         'prio_col': 'Prio_MRR',
         'desc': 'Ingresos Recurrentes ($)',
         'std': 0, 
-        'mayor_mejor': True
+        'mayor_mejor': True,
+        'agg': 'last'
     }
 }
\ No newline at end of file
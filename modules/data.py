@@ -1,9 +1,16 @@
 # modules/data.py
+import numpy as np
 import pandas as pd
-import streamlit as st
 from functools import reduce
-from modules.config import URL_EXPORT, CONFIG_HOJAS
-from modules.logic import clasificar_ciclo_vida, calcular_tendencia_trx, generar_diagnostico_cliente
+from datetime import datetime
+from modules.config import (URL_EXPORT, CONFIG_HOJAS, COLS_SEGMENTACION, SIN_ASIGNAR,
+                            GRANULARIDAD, FORMATOS_FECHA, RESAMPLEAR_CICLO_VIDA, USAR_HISTORIA_LOCAL)
+from modules.logic import (clasificar_ciclo_vida, calcular_tendencia_trx, generar_diagnostico_cartera,
+                           calcular_ranking_cohortes, detectar_anomalias, proyectar_siguiente_periodo,
+                           resamplear_mensual, llevar_a_ritmo_mensual, periodos_observados, calcular_pendientes,
+                           PERIODOS_POR_MES, ETIQUETAS_ESTADO, ETIQUETAS_MOTIVO)
+from modules.snapshot import guardar_snapshot
+from modules.historia import completar_historia
 
 def procesar_dataframe(df, kpi_name, is_percentage=False):
     """
@@ -38,24 +45,61 @@ def procesar_dataframe(df, kpi_name, is_percentage=False):
 
     df = df.dropna(subset=['Client'])
     df['Client'] = df['Client'].astype(str).str.strip()
-    df = df.set_index('Client')
 
-    for col in df.columns:
-        df[col] = df[col].astype(str).str.replace(',', '', regex=False)
-        if is_percentage:
-            df[col] = df[col].str.replace('%', '', regex=False)
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    df = df.fillna(0)
+    # 4. LIMPIEZA NUMÉRICA (una sola pasada sobre la columna larga, no una por fecha)
+    df = df.melt(id_vars='Client', var_name='Date', value_name=kpi_name)
+    valores = df[kpi_name].astype(str).str.replace(',', '', regex=False)
+    if is_percentage:
+        valores = valores.str.replace('%', '', regex=False)
+    valores = pd.to_numeric(valores, errors='coerce').fillna(0)
     if is_percentage:
-        df = df / 100.0
-        
-    return df.reset_index().melt(id_vars='Client', var_name='Date', value_name=kpi_name)
+        valores = valores / 100.0
+    df[kpi_name] = valores
+
+    # 5. FECHAS: se parsean por hoja (cada hoja puede usar otro formato de encabezado para el mismo mes)
+    df['Date_Obj'] = parsear_fechas(df['Date'])
+    df = df.dropna(subset=['Date_Obj']).drop_duplicates(subset=['Client', 'Date_Obj'], keep='last')
+
+    return df
 
-@st.cache_data(ttl=600)
-def cargar_todo_aura():
+def parsear_fechas(serie_fechas):
     """
-    Función Principal ETL (Extract, Transform, Load).
+    Convierte los encabezados de fecha a datetime probando FORMATOS_FECHA en orden.
+    Se parsean sólo los valores únicos (con semanas/días hay muchas filas por fecha).
+    """
+    unicos = pd.Series(pd.unique(serie_fechas))
+    resultado = pd.Series(pd.NaT, index=unicos.index, dtype='datetime64[ns]')
+
+    # Encabezados que Excel ya entrega como fecha
+    es_fecha = unicos.map(lambda v: isinstance(v, (pd.Timestamp, datetime)))
+    if es_fecha.any():
+        resultado[es_fecha] = pd.to_datetime(unicos[es_fecha])
+
+    texto = unicos.astype(str).str.strip()
+    texto = texto.where(~texto.str.match(r'^\d{4}-W\d{2}$'), texto + '-1')  # Semana ISO -> lunes
+    for fmt in FORMATOS_FECHA:
+        pendientes = resultado.isna() & ~es_fecha
+        if not pendientes.any(): break
+        resultado[pendientes] = pd.to_datetime(texto[pendientes], format=fmt, errors='coerce')
+
+    return serie_fechas.map(dict(zip(unicos, resultado)))
+
+def refrescar_snapshot():
+    """
+    Ejecuta el ETL (apto para hilos en segundo plano) y, si termina bien,
+    guarda el resultado como snapshot local.
+    Retorna: (version, log) o (None, mensaje de error).
+    """
+    descargado = datetime.now()
+    df_hist, df_resumen, df_alertas, log = ejecutar_etl_aura()
+    if df_hist is None:
+        return None, log
+    return guardar_snapshot(df_hist, df_resumen, df_alertas, log, generado=descargado), log
+
+def ejecutar_etl_aura():
+    """
+    ETL completo: descarga el Excel, unifica la historia y calcula el diagnóstico.
+    Retorna: (df_hist, df_resumen, df_alertas, log) o (None, None, None, mensaje de error).
     """
     try:
         all_sheets = pd.read_excel(URL_EXPORT, sheet_name=None)
@@ -73,15 +117,47 @@ def cargar_todo_aura():
 
     if not lista_dfs: return None, None, None, "No hay datos en el Excel."
 
-    # 2. UNIFICAR HISTORIA
-    df_hist = reduce(lambda l, r: pd.merge(l, r, on=['Client', 'Date'], how='outer'), lista_dfs)
-    
-    df_hist['Date_Obj'] = pd.to_datetime(df_hist['Date'], format='%b-%Y', errors='coerce')
-    df_hist = df_hist.dropna(subset=['Date_Obj']).sort_values(by=['Client', 'Date_Obj']).fillna(0)
+    # 2. UNIFICAR HISTORIA (por fecha ya parseada; la etiqueta 'Date' es la de la primera hoja que trae ese período)
+    etiquetas = pd.concat([d[['Date_Obj', 'Date']] for d in lista_dfs]).drop_duplicates('Date_Obj')
+    df_hist = reduce(lambda l, r: pd.merge(l, r, on=['Client', 'Date_Obj'], how='outer'),
+                     [d.drop(columns='Date') for d in lista_dfs])
+    df_hist.insert(1, 'Date', df_hist['Date_Obj'].map(etiquetas.set_index('Date_Obj')['Date']))
+    kpis_hojas = [c for c in df_hist.columns if c not in ('Client', 'Date', 'Date_Obj')]
+    df_hist = df_hist[['Client', 'Date'] + kpis_hojas + ['Date_Obj']]
+    df_hist = df_hist.sort_values(by=['Client', 'Date_Obj']).fillna(0)
+
+    # Historia local: guarda los meses del Sheet y recupera los que el Sheet ya recortó
+    kpis_hist = [cfg['kpi'] for cfg in CONFIG_HOJAS.values() if cfg['kpi'] in df_hist.columns]
+    historia_mensual = None
+    if USAR_HISTORIA_LOCAL:
+        try:
+            if GRANULARIDAD == 'mensual':
+                df_hist = completar_historia(df_hist, kpis_hist)
+                df_hist['Date'] = df_hist['Date'].fillna(df_hist['Date_Obj'].dt.strftime('%b-%Y'))
+            else:
+                # Con cuántos períodos se armó cada mes: un mes recortado no pisa al completo ya guardado
+                historia_mensual = resamplear_mensual(df_hist, kpis_hist)
+                historia_mensual = completar_historia(historia_mensual, kpis_hist,
+                                                      periodos_observados(historia_mensual, df_hist))
+        except Exception as e:
+            log.append(f"⚠️ Historia local no disponible: {e}")
+    if GRANULARIDAD != 'mensual' and historia_mensual is None:
+        historia_mensual = resamplear_mensual(df_hist, kpis_hist)
+
+    # Anomalías sobre todas las series Cliente x KPI (marca columnas Anom_<KPI> en df_hist)
+    df_hist, df_alertas_anom = detectar_anomalias(df_hist)
 
     # 3. CREAR SNAPSHOT (Resumen)
     df_last = df_hist.sort_values('Date_Obj').groupby('Client').tail(1).copy()
 
+    # Con datos semanales/diarios las metas (Goals / std) son mensuales: se evalúa el mes en curso
+    # (los KPIs 'sum' llevados a ritmo de mes completo), no la última semana / día suelto.
+    historia_eval = df_hist
+    if GRANULARIDAD != 'mensual':
+        historia_eval = llevar_a_ritmo_mensual(historia_mensual, df_hist)
+        mes_en_curso = historia_eval.sort_values('Date_Obj').groupby('Client').tail(1).set_index('Client')
+        df_last[kpis_hist] = mes_en_curso[kpis_hist].reindex(df_last['Client']).to_numpy()
+
     # 4. MERGE MAESTROS (Goals, Prioridad, etc.)
     # Función auxiliar para merges de metadatos
     def merge_metadata(df_main, sheet_name):
@@ -107,34 +183,47 @@ def cargar_todo_aura():
     df_last = merge_metadata(df_last, 'Caracteristicas cliente')
 
     # 5. FASE 1: Ciclo de Vida
-    tendencias = {}
-    for client in df_hist['Client'].unique():
-        historia = df_hist[df_hist['Client'] == client].sort_values('Date_Obj')['Transacciones']
-        tendencias[client] = calcular_tendencia_trx(historia)
+    # df_hist ya viene ordenado por Client, Date_Obj: un solo groupby en vez de filtrar por cliente
+    tendencias = df_hist.groupby('Client', sort=False)['Transacciones'].apply(calcular_tendencia_trx)
     df_last['Tendencia_Trx'] = df_last['Client'].map(tendencias)
 
-    df_trx_pivot = df_hist.pivot(index='Client', columns='Date_Obj', values='Transacciones').fillna(0)
-    df_fase1 = df_trx_pivot.apply(clasificar_ciclo_vida, axis=1).reset_index()
+    # Pendientes de todos los KPIs en lote (evita un polyfit por cliente x KPI en el diagnóstico)
+    df_pend = calcular_pendientes(df_hist, kpis_hist).add_prefix('Pendiente_')
+    df_last = df_last.merge(df_pend, left_on='Client', right_index=True, how='left')
+
+    # Con datos semanales/diarios, el ciclo de vida puede evaluarse sobre meses consolidados
+    if GRANULARIDAD != 'mensual' and RESAMPLEAR_CICLO_VIDA:
+        df_base_fase1, ppm_fase1 = historia_mensual, 1
+    else:
+        df_base_fase1, ppm_fase1 = df_hist, PERIODOS_POR_MES
+    df_trx_pivot = df_base_fase1.pivot(index='Client', columns='Date_Obj', values='Transacciones').fillna(0)
+    df_fase1 = df_trx_pivot.apply(clasificar_ciclo_vida, axis=1, periodos_por_mes=ppm_fase1).reset_index()
     df_fase1.columns = ['Client', 'Fase_Vida']
     
     df_resumen = pd.merge(df_last, df_fase1, on='Client', how='left')
 
-    # 6. FASE 3: Diagnóstico
-    resultados_diag = []
-    for idx, row in df_resumen.iterrows():
-        cliente = row['Client']
-        historia_cliente = df_hist[df_hist['Client'] == cliente]
-        res = generar_diagnostico_cliente(row, historia_cliente)
-        resultados_diag.append(res)
-        
-    df_resumen['Estado_AURA'] = [x[0] for x in resultados_diag]
-    df_resumen['Alertas_Detalle'] = [x[1] for x in resultados_diag]
-    df_resumen['Motivo_Critico'] = [x[2] for x in resultados_diag]
+    # 6. FASE 3: Diagnóstico (en lote; las alertas quedan como tabla, el texto se arma al mostrar)
+    estado_cod, motivo_cod, n_alertas, df_alertas = generar_diagnostico_cartera(df_resumen)
+    df_resumen['Estado_Cod'] = estado_cod
+    df_resumen['Estado_AURA'] = pd.Categorical.from_codes(estado_cod, categories=ETIQUETAS_ESTADO)
+    df_resumen['Motivo_Critico'] = pd.Categorical.from_codes(motivo_cod, categories=ETIQUETAS_MOTIVO)
+    df_resumen['N_Alertas'] = n_alertas + df_resumen['Client'].map(df_alertas_anom['Client'].value_counts()).fillna(0).astype(np.int16)
+
+    # Alertas de anomalías al final de las de cada cliente
+    df_alertas = pd.concat([df_alertas, df_alertas_anom], ignore_index=True)
+    df_alertas['Client'] = pd.Categorical(df_alertas['Client'], categories=df_resumen['Client'].unique())
+    df_alertas = df_alertas.sort_values('Client', kind='stable', ignore_index=True)
 
     # Rellenar vacíos en características nuevas con "Sin Asignar" para que los gráficos no fallen
-    cols_posibles = ['Region', 'Vertical', 'Año', 'Tipo', 'region', 'vertical', 'año', 'tipo']
     for col in df_resumen.columns:
-        if col.lower() in cols_posibles:
-            df_resumen[col] = df_resumen[col].fillna('Sin Asignar').astype(str)
+        if col.lower() in COLS_SEGMENTACION:
+            df_resumen[col] = df_resumen[col].fillna(SIN_ASIGNAR).astype(str)
+
+    # 7. BENCHMARK VS PARES (Percentil por Region / Vertical / ...)
+    df_resumen = calcular_ranking_cohortes(df_resumen)
+
+    # 8. PROYECCIÓN PRÓXIMO PERÍODO (Valor esperado + Probabilidad de fallar la meta)
+    # Semanal/diario: se proyecta el próximo mes, que es la unidad de las metas.
+    df_resumen = proyectar_siguiente_periodo(historia_eval, df_resumen)
 
-    return df_hist, df_resumen, log
\ No newline at end of file
+    return df_hist, df_resumen, df_alertas, log
\ No newline at end of file
@@ -0,0 +1,290 @@
+# modules/historia.py
+# Almacén local append-only de la historia mensual (Client, Date, KPIs).
+#
+# Estructura en disco (una partición por mes, nunca se borran):
+#   HISTORIA_DIR/2024-01/ACTUAL                 -> nombre de la versión vigente (se cambia con os.replace)
+#   HISTORIA_DIR/2024-01/<hash>/clientes.npy    -> nombres de cliente (unicode, mmap)
+#   HISTORIA_DIR/2024-01/<hash>/valores.npy     -> matriz float64 clientes x KPIs (mmap, NaN = nunca visto)
+#   HISTORIA_DIR/2024-01/<hash>/periodos.npy    -> períodos (semanas/días) que consolidó cada fila (NaN = desconocido)
+#   HISTORIA_DIR/2024-01/<hash>/meta.json       -> columnas KPI y hash del contenido
+# Los lectores no toman lock: siempre ven una versión completa (la vigente o la anterior, que se conserva).
+# Los escritores (hilo de refresco, botón de recarga, otros procesos) se serializan con HISTORIA_DIR/.lock.
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from modules.config import HISTORIA_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FMT_PARTICION = '%Y-%m'
+PUNTERO = 'ACTUAL'
+ARCHIVOS_VERSION = ('clientes.npy', 'valores.npy', 'periodos.npy', 'meta.json')
+
+
+@contextmanager
+def _bloqueo():
+    """Lock exclusivo entre hilos y procesos sobre HISTORIA_DIR/.lock (bloqueante)."""
+    os.makedirs(HISTORIA_DIR, exist_ok=True)
+    with open(os.path.join(HISTORIA_DIR, '.lock'), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _particiones():
+    """
+    Meses guardados (ordenados). Sólo lista nombres de carpeta, no abre archivos:
+    el puntero a la versión vigente se resuelve después, sólo para los meses del rango pedido.
+    """
+    if not os.path.isdir(HISTORIA_DIR):
+        return []
+    return sorted(d for d in os.listdir(HISTORIA_DIR)
+                  if len(d) == 7 and d[4] == '-' and os.path.isdir(os.path.join(HISTORIA_DIR, d)))
+
+
+def _carpeta_vigente(particion):
+    """Carpeta de la versión vigente del mes (o la partición misma si es del formato anterior, sin versiones)."""
+    base = os.path.join(HISTORIA_DIR, particion)
+    try:
+        with open(os.path.join(base, PUNTERO), encoding='utf-8') as f:
+            return os.path.join(base, f.read().strip())
+    except OSError:
+        return base if os.path.isfile(os.path.join(base, 'meta.json')) else None
+
+
+def _hash_mes(clientes, valores, kpis, periodos):
+    h = hashlib.sha1()
+    h.update(json.dumps(kpis).encode('utf-8'))
+    h.update(clientes.astype('U').tobytes())
+    h.update(np.ascontiguousarray(valores, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(periodos, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def _leer_meta(carpeta):
+    try:
+        with open(os.path.join(carpeta, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _leer_particion(particion, mmap_mode='r'):
+    """
+    (meta, nombres, valores, periodos) de la versión vigente, o None si no hay.
+    Si justo se reemplazó la versión mientras se leía, se reintenta con el puntero nuevo.
+    """
+    for _ in range(3):
+        carpeta = _carpeta_vigente(particion)
+        if carpeta is None:
+            return None
+        try:
+            meta = _leer_meta(carpeta)
+            if meta is None:
+                continue
+            nombres = np.load(os.path.join(carpeta, 'clientes.npy'), mmap_mode=mmap_mode)
+            valores = np.load(os.path.join(carpeta, 'valores.npy'), mmap_mode=mmap_mode)
+            ruta_periodos = os.path.join(carpeta, 'periodos.npy')
+            periodos = (np.load(ruta_periodos, mmap_mode=mmap_mode) if os.path.isfile(ruta_periodos)
+                        else np.full(len(nombres), np.nan))  # Versiones anteriores no lo guardaban
+            return meta, nombres, valores, periodos
+        except OSError:
+            continue
+    return None
+
+
+def _fusionar(existente, clientes, valores, kpis, periodos):
+    """
+    Upsert de un mes: las filas que llegan pisan a las guardadas salvo que consoliden menos períodos
+    (mes recortado por el Sheet: no reemplaza al mes completo ya guardado, sólo completa celdas vacías).
+    Lo que no llega (cliente que salió del Sheet, hoja faltante) se conserva. Nunca se elimina una celda.
+    """
+    if existente is None:
+        return clientes, valores, list(kpis), periodos
+
+    meta, nombres_prev, valores_prev, periodos_prev = existente
+    kpis_todos = list(meta['kpis']) + [k for k in kpis if k not in meta['kpis']]
+    clientes_todos = np.union1d(np.asarray(nombres_prev, dtype='U'), clientes)
+
+    fusion = np.full((len(clientes_todos), len(kpis_todos)), np.nan)
+    periodos_todos = np.full(len(clientes_todos), np.nan)
+    filas_prev = np.searchsorted(clientes_todos, np.asarray(nombres_prev, dtype='U'))
+    fusion[filas_prev, :len(meta['kpis'])] = np.asarray(valores_prev, dtype=np.float64)
+    periodos_todos[filas_prev] = np.asarray(periodos_prev, dtype=np.float64)
+
+    filas = np.searchsorted(clientes_todos, clientes)
+    columnas = [kpis_todos.index(k) for k in kpis]
+    pisa = periodos >= np.nan_to_num(periodos_todos[filas], nan=0.0)
+    actual = fusion[np.ix_(filas, columnas)]
+    fusion[np.ix_(filas, columnas)] = np.where(pisa[:, None] | np.isnan(actual), valores, actual)
+    periodos_todos[filas] = np.where(pisa, periodos, periodos_todos[filas])
+    return clientes_todos, fusion, kpis_todos, periodos_todos
+
+
+def _escribir_version(particion, clientes, valores, kpis, periodos, firma):
+    """Escribe la versión en una carpeta propia (nombre = hash) y la publica cambiando el puntero."""
+    base = os.path.join(HISTORIA_DIR, particion)
+    os.makedirs(base, exist_ok=True)
+    version = firma[:16]
+    destino = os.path.join(base, version)
+
+    if _leer_meta(destino) is None:
+        tmp = tempfile.mkdtemp(dir=base, prefix='.tmp-')
+        try:
+            np.save(os.path.join(tmp, 'clientes.npy'), clientes)
+            np.save(os.path.join(tmp, 'valores.npy'), valores)
+            np.save(os.path.join(tmp, 'periodos.npy'), np.asarray(periodos, dtype=np.float64))
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'kpis': kpis, 'hash': firma, 'filas': len(clientes)}, f)
+            shutil.rmtree(destino, ignore_errors=True)  # restos de una escritura interrumpida
+            os.replace(tmp, destino)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    fd, tmp_puntero = tempfile.mkstemp(dir=base, prefix='.tmp-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_puntero, os.path.join(base, PUNTERO))
+    return version
+
+
+def _limpiar_versiones(particion, version, previa):
+    """Borra versiones viejas del mes, salvo la vigente y la anterior (puede haber lectores en ella)."""
+    base = os.path.join(HISTORIA_DIR, particion)
+    legado = previa == base  # Versión anterior en el formato sin versiones (archivos sueltos en la partición)
+    conservar = {PUNTERO, version}
+    if previa and not legado:
+        conservar.add(os.path.basename(previa))
+    for nombre in os.listdir(base):
+        if nombre in conservar or (legado and nombre in ARCHIVOS_VERSION):
+            continue
+        ruta = os.path.join(base, nombre)
+        if os.path.isdir(ruta):
+            shutil.rmtree(ruta, ignore_errors=True)
+        elif nombre.startswith('.tmp-') or nombre in ARCHIVOS_VERSION:
+            os.remove(ruta)
+
+
+def guardar_meses(df_mensual, kpis, periodos=None):
+    """
+    Fusiona la historia mensual en el almacén de forma idempotente:
+    - Meses nuevos se agregan.
+    - Meses existentes se actualizan celda a celda (cliente x KPI): lo que llega pisa lo guardado
+      (el Sheet corrigió datos) y lo que no llega se conserva (hoja faltante, cliente que salió).
+    - Una fila que consolida menos períodos que la guardada no la pisa (mes recortado por el Sheet).
+    - Meses que ya no están en el Sheet se conservan intactos.
+    'periodos': semanas/días que consolidó cada fila de df_mensual (None = datos mensuales, 1 por fila).
+    Retorna: cantidad de particiones escritas.
+    """
+    df_mensual = df_mensual.assign(_periodos=1.0 if periodos is None else np.asarray(periodos, dtype=np.float64))
+    escritas = 0
+    with _bloqueo():
+        for fecha, df_mes in df_mensual.groupby('Date_Obj', sort=True):
+            particion = fecha.strftime(FMT_PARTICION)
+            df_mes = df_mes.drop_duplicates('Client', keep='last').sort_values('Client')
+            clientes = df_mes['Client'].astype(str).to_numpy(dtype='U')
+            valores = df_mes[kpis].to_numpy(dtype=np.float64)
+
+            existente = _leer_particion(particion, mmap_mode=None)
+            clientes, valores, kpis_mes, per = _fusionar(existente, clientes, valores, kpis,
+                                                         df_mes['_periodos'].to_numpy())
+            firma = _hash_mes(clientes, valores, kpis_mes, per)
+            if existente is not None and existente[0].get('hash') == firma:
+                continue
+
+            previa = _carpeta_vigente(particion)
+            version = _escribir_version(particion, clientes, valores, kpis_mes, per, firma)
+            _limpiar_versiones(particion, version, previa)
+            escritas += 1
+    return escritas
+
+
+def leer_historia(desde=None, hasta=None, clientes=None, kpis=None, con_periodos=False):
+    """
+    Lee la historia del almacén con filtro de rango [desde, hasta) aplicado sobre los nombres
+    de partición (no se abre ningún mes fuera del rango). Los arreglos se abren con mmap.
+    Retorna: df con Client, Date_Obj y las columnas KPI (faltantes -> 0);
+    con_periodos agrega 'Periodos' (períodos consolidados por fila, 0 = desconocido).
+    """
+    desde_txt = pd.Timestamp(desde).strftime(FMT_PARTICION) if desde is not None else None
+    hasta_txt = pd.Timestamp(hasta).strftime(FMT_PARTICION) if hasta is not None else None
+    filtro_clientes = np.asarray(sorted(set(clientes)), dtype='U') if clientes is not None else None
+
+    partes = []
+    for particion in _particiones():
+        if desde_txt and particion < desde_txt: continue
+        if hasta_txt and particion >= hasta_txt: break
+
+        leido = _leer_particion(particion)
+        if leido is None: continue
+        meta, nombres, valores, periodos = leido
+
+        filas = np.isin(nombres, filtro_clientes) if filtro_clientes is not None else slice(None)
+        df_mes = pd.DataFrame(np.asarray(valores[filas]), columns=meta['kpis'])
+        df_mes.insert(0, 'Client', np.asarray(nombres[filas]).astype(object))
+        df_mes.insert(1, 'Date_Obj', pd.Timestamp(f"{particion}-01"))
+        if con_periodos:
+            df_mes['Periodos'] = np.nan_to_num(np.asarray(periodos[filas], dtype=np.float64), nan=0.0)
+        partes.append(df_mes)
+
+    columnas = ['Client', 'Date_Obj'] + list(kpis or []) + (['Periodos'] if con_periodos else [])
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    df = pd.concat(partes, ignore_index=True)
+    if kpis is not None:
+        df = df.reindex(columns=columnas)
+    kpis_df = [c for c in df.columns if c not in ('Client', 'Date_Obj', 'Periodos')]
+    df[kpis_df] = df[kpis_df].fillna(0.0)  # Celdas nunca vistas (KPI agregado después, etc.)
+    return df
+
+
+def completar_historia(df_mensual, kpis, periodos=None):
+    """
+    Guarda los meses del Sheet en el almacén y antepone los meses más viejos que el Sheet
+    ya no tiene (sólo de los clientes que siguen en el Sheet).
+    Con 'periodos' (datos semanales/diarios consolidados), los meses que el Sheet trae recortados
+    se reemplazan por la versión guardada si ésta consolidó más períodos.
+    """
+    guardar_meses(df_mensual, kpis, periodos)
+    if df_mensual.empty:
+        return df_mensual
+
+    if periodos is not None:
+        guardados = leer_historia(desde=df_mensual['Date_Obj'].min(), clientes=df_mensual['Client'].unique(),
+                                  kpis=kpis, con_periodos=True)
+        mejor = df_mensual[['Client', 'Date_Obj']].merge(guardados, on=['Client', 'Date_Obj'], how='left')
+        usar = (mejor['Periodos'].fillna(0.0) > np.asarray(periodos, dtype=np.float64)).to_numpy()
+        if usar.any():
+            df_mensual = df_mensual.reset_index(drop=True)
+            df_mensual[kpis] = df_mensual[kpis].astype(float)
+            df_mensual.loc[usar, kpis] = mejor.loc[usar, kpis].to_numpy(dtype=float)
+
+    anteriores = leer_historia(hasta=df_mensual['Date_Obj'].min(), clientes=df_mensual['Client'].unique(), kpis=kpis)
+    if anteriores.empty:
+        return df_mensual
+    df = pd.concat([anteriores, df_mensual], ignore_index=True)[df_mensual.columns]
+    return df.sort_values(['Client', 'Date_Obj'], ignore_index=True)
@@ -1,13 +1,26 @@
 # modules/logic.py
+import math
 import pandas as pd
 import numpy as np
-from modules.config import CONFIG_HOJAS
+from numpy.lib.stride_tricks import sliding_window_view
+from modules.config import (CONFIG_HOJAS, COLS_SEGMENTACION, SIN_ASIGNAR, MIN_COHORTE, CONFIG_ANOMALIAS, CONFIG_PROYECCION,
+                            GRANULARIDAD, CONFIG_GRANULARIDAD)
+
+PERIODOS_POR_MES = CONFIG_GRANULARIDAD[GRANULARIDAD]['periodos_por_mes']
+FMT_PERIODO = CONFIG_GRANULARIDAD[GRANULARIDAD]['fmt']
+
+def periodos(meses):
+    """Convierte una ventana pensada en meses a cantidad de períodos de la granularidad activa."""
+    return max(1, int(round(meses * PERIODOS_POR_MES)))
 
 # ==========================================
 # FASE 1: CLASIFICACIÓN CICLO DE VIDA
 # ==========================================
-def clasificar_ciclo_vida(serie_trx):
-    """Determina en qué etapa de vida está el cliente según sus transacciones históricas."""
+def clasificar_ciclo_vida(serie_trx, periodos_por_mes=1):
+    """
+    Determina en qué etapa de vida está el cliente según sus transacciones históricas.
+    Si la serie no es mensual, 'periodos_por_mes' convierte períodos activos a meses.
+    """
     vals = serie_trx.values
     total_historico = vals.sum()
     
@@ -15,7 +28,7 @@ def clasificar_ciclo_vida(serie_trx):
     
     trx_mes_actual = vals[-1]
     trx_mes_anterior = vals[-2] if len(vals) > 1 else 0
-    meses_con_actividad = (vals > 0).sum()
+    meses_con_actividad = math.ceil((vals > 0).sum() / periodos_por_mes)
     
     if trx_mes_actual > 0:
         if meses_con_actividad == 1: return "Deployment 🚀"
@@ -29,33 +42,402 @@ def clasificar_ciclo_vida(serie_trx):
 # UTILIDADES MATEMÁTICAS
 # ==========================================
 def calcular_direccion_tendencia(serie):
-    """Calcula la pendiente de los últimos 6 meses para saber si sube o baja."""
+    """Calcula la pendiente (por período) de los últimos 6 meses para saber si sube o baja."""
     vals = serie.values
     if len(vals) < 2: return 0
     
-    y = vals[-6:] 
+    y = vals[-periodos(6):] 
     x = np.arange(len(y))
     
     if np.var(y) == 0: return 0 
     slope = np.polyfit(x, y, 1)[0]
     return slope
 
+def calcular_pendientes(df_hist, kpis):
+    """
+    Misma pendiente que calcular_direccion_tendencia, pero para todos los clientes y KPIs
+    de una vez (mínimos cuadrados en forma cerrada sobre sumas agrupadas).
+    df_hist debe venir ordenado por Client, Date_Obj. Retorna un df indexado por Client.
+    """
+    cola = df_hist.groupby('Client', sort=False).tail(periodos(6))
+    x = cola.groupby('Client', sort=False).cumcount().to_numpy(dtype=float)
+    y = cola[kpis].to_numpy(dtype=float)
+    sumas = pd.DataFrame(np.column_stack([np.ones(len(x)), x, x * x, y, y * x[:, None], y * y]),
+                         index=cola['Client']).groupby(level=0, sort=False).sum().to_numpy()
+
+    k = len(kpis)
+    n, sx, sxx = sumas[:, 0:1], sumas[:, 1:2], sumas[:, 2:3]
+    sy, sxy, syy = sumas[:, 3:3 + k], sumas[:, 3 + k:3 + 2 * k], sumas[:, 3 + 2 * k:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pendiente = (n * sxy - sx * sy) / (n * sxx - sx ** 2)
+        varianza = syy / n - (sy / n) ** 2
+    # Igual que la versión por serie: < 2 puntos o serie plana -> 0
+    pendiente = np.where((n >= 2) & (varianza > 1e-12 * np.maximum(1.0, (sy / n) ** 2)), pendiente, 0.0)
+    return pd.DataFrame(pendiente, index=cola['Client'].unique(), columns=kpis)
+
 def calcular_tendencia_trx(serie_trx):
     """Lógica específica para Transacciones (Detectar caídas bruscas >40%)."""
     vals = serie_trx.values
     if len(vals) < 2: return "Estable ↔️"
     
-    if len(vals) >= 4:
+    ventana = periodos(3)
+    if len(vals) >= ventana + 1:
         ultimo = vals[-1]
-        promedio = vals[-4:-1].mean()
+        promedio = vals[-ventana - 1:-1].mean()
         if promedio > 0 and ultimo < (promedio * 0.60):
             return "En Riesgo ↘️ (Caída >40%)"
             
-    slope = calcular_direccion_tendencia(serie_trx)
+    # Pendiente llevada a "por mes" para que el umbral no dependa de la granularidad
+    slope = calcular_direccion_tendencia(serie_trx) * PERIODOS_POR_MES
     if slope > 0.5: return "Crecimiento ↗️"
     elif slope < -0.5: return "En Riesgo ↘️"
     else: return "Estable ↔️"
 
+def resamplear_mensual(df_hist, kpis=None):
+    """
+    Consolida una historia semanal/diaria a meses según el 'agg' de cada KPI en CONFIG_HOJAS.
+    Retorna un df con las mismas columnas (Client, Date_Obj, KPIs) a nivel mensual.
+    """
+    reglas = {cfg['kpi']: cfg.get('agg', 'mean') for cfg in CONFIG_HOJAS.values()
+              if cfg['kpi'] in df_hist.columns and (kpis is None or cfg['kpi'] in kpis)}
+    mes = df_hist['Date_Obj'].dt.to_period('M').dt.to_timestamp().rename('Date_Obj')
+    return df_hist.groupby([df_hist['Client'], mes], sort=True).agg(reglas).reset_index()
+
+def periodos_observados(df_mensual, df_hist):
+    """Cuántos períodos de df_hist consolidó cada fila (Client, mes) de df_mensual (0 si ninguno)."""
+    mes = df_hist['Date_Obj'].dt.to_period('M').dt.to_timestamp().rename('Date_Obj')
+    observados = df_hist.groupby([df_hist['Client'], mes]).size().rename('n').reset_index()
+    n = df_mensual[['Client', 'Date_Obj']].merge(observados, on=['Client', 'Date_Obj'], how='left')['n']
+    return n.fillna(0).to_numpy(dtype=float)
+
+def llevar_a_ritmo_mensual(df_mensual, df_hist):
+    """
+    El último mes de cada cliente (mes en curso) suele estar incompleto con datos semanales/diarios:
+    los KPIs 'sum' se escalan a mes completo (valor / períodos observados x PERIODOS_POR_MES)
+    para poder compararlos contra metas mensuales. Los KPIs 'mean' / 'last' no cambian.
+    """
+    sumas = [cfg['kpi'] for cfg in CONFIG_HOJAS.values()
+             if cfg.get('agg') == 'sum' and cfg['kpi'] in df_mensual.columns]
+    if df_mensual.empty or not sumas:
+        return df_mensual
+
+    df = df_mensual.copy()
+    ultimo = df.groupby('Client')['Date_Obj'].transform('max') == df['Date_Obj']
+    n = periodos_observados(df.loc[ultimo], df_hist)
+    with np.errstate(divide='ignore'):
+        factor = np.where(n > 0, np.maximum(1.0, PERIODOS_POR_MES / n), 1.0)
+    df[sumas] = df[sumas].astype(float)  # Hojas 100% enteras llegan como int64: el ritmo es fraccionario
+    df.loc[ultimo, sumas] = df.loc[ultimo, sumas].to_numpy(dtype=float) * factor[:, None]
+    return df
+
+# ==========================================
+# BENCHMARK: PERCENTIL VS PARES (COHORTES)
+# ==========================================
+def calcular_ranking_cohortes(df_resumen):
+    """
+    Calcula, para cada dimensión de segmentación y cada KPI, el percentil del cliente
+    dentro de su cohorte y la mediana de la cohorte. Un solo groupby por dimensión.
+    El percentil siempre se lee "más alto = mejor" (se invierte si mayor_mejor es False).
+    Cohortes con menos de MIN_COHORTE clientes quedan en NaN (no se comparan).
+    Agrega columnas: Pctl_<Dim>_<KPI> (0-100) y Mediana_<Dim>_<KPI>.
+    """
+    kpis = [cfg['kpi'] for cfg in CONFIG_HOJAS.values() if cfg['kpi'] in df_resumen.columns]
+    dims = [c for c in df_resumen.columns if str(c).lower() in COLS_SEGMENTACION]
+    if not kpis or not dims:
+        return df_resumen
+
+    valores = df_resumen[kpis].astype(float)
+    signo = np.array([1.0 if cfg.get('mayor_mejor', True) else -1.0
+                      for cfg in CONFIG_HOJAS.values() if cfg['kpi'] in kpis])
+    valores_orientados = valores * signo
+
+    bloques = []
+    for dim in dims:
+        grupo = df_resumen[dim].where(df_resumen[dim] != SIN_ASIGNAR)
+        grupo = grupo.where(grupo.map(grupo.value_counts()) >= MIN_COHORTE)
+        pctl = valores_orientados.groupby(grupo).rank(pct=True) * 100
+        mediana = valores.groupby(grupo).transform('median')
+        pctl.columns = [f"Pctl_{dim}_{k}" for k in kpis]
+        mediana.columns = [f"Mediana_{dim}_{k}" for k in kpis]
+        bloques.extend([pctl, mediana])
+
+    return pd.concat([df_resumen] + bloques, axis=1)
+
+def texto_percentil_cohortes(row, kpi):
+    """Texto corto para tarjetas: 'p72 en su Vertical · p40 en su Region'."""
+    partes = []
+    for dim in COLS_SEGMENTACION:
+        val = row.get(f"Pctl_{dim}_{kpi}", np.nan)
+        if pd.notna(val):
+            partes.append(f"p{val:.0f} en su {dim}")
+    return " · ".join(partes)
+
+# ==========================================
+# MODELO DE ALERTAS (TABLA ESTRUCTURADA + FORMATO PEREZOSO)
+# ==========================================
+# Cada alerta es una fila: Client, KPI (clave de CONFIG_HOJAS), Severidad, Es_Estrella, Valor, Fecha.
+# El texto markdown/emoji sólo se arma al mostrar (formatear_alerta / textos_alertas).
+ANOM_NINGUNA, ANOM_ATIPICO, ANOM_CAMBIO_NIVEL = 0, 1, 2
+ETIQUETAS_ANOMALIA = {ANOM_ATIPICO: "Valor atípico", ANOM_CAMBIO_NIVEL: "Cambio de nivel"}
+
+SEV_ATENCION, SEV_CRITICO, SEV_ATIPICO, SEV_CAMBIO_NIVEL = 1, 2, 3, 4
+SEV_POR_ANOMALIA = {ANOM_ATIPICO: SEV_ATIPICO, ANOM_CAMBIO_NIVEL: SEV_CAMBIO_NIVEL}
+
+ESTADO_SALUDABLE, ESTADO_ATENCION, ESTADO_REVISION, ESTADO_CRITICO = 0, 1, 2, 3
+ETIQUETAS_ESTADO = ["Saludable / Campeón 🏆", "Atención Operativa", "Revisión Profunda", "Crítico / Riesgo"]
+
+MOTIVO_NINGUNO, MOTIVO_CHURN, MOTIVO_ESTRELLA = 0, 1, 2
+ETIQUETAS_MOTIVO = ["", "🚨 ALERTA CHURN: Caída de volumen crítica + Insatisfacción.", "Fallo en KPI Estrella (Prioridad 3)."]
+
+COLS_ALERTAS = ['Client', 'KPI', 'Severidad', 'Es_Estrella', 'Valor', 'Fecha']
+
+def tabla_alertas(clientes, kpis, severidad, es_estrella, valor, fecha=None):
+    """Arma la tabla compacta de alertas (KPI categórico, severidad int8)."""
+    n = len(clientes)
+    return pd.DataFrame({
+        'Client': np.asarray(clientes, dtype=object),
+        'KPI': pd.Categorical(kpis, categories=list(CONFIG_HOJAS)),
+        'Severidad': np.asarray(severidad, dtype=np.int8),
+        'Es_Estrella': np.asarray(es_estrella, dtype=bool),
+        'Valor': np.asarray(valor, dtype=float),
+        'Fecha': pd.to_datetime(fecha) if fecha is not None else pd.Series(pd.NaT, index=range(n)),
+    })
+
+def formatear_alerta(kpi_key, severidad, es_estrella, valor, fecha=None):
+    """Texto markdown de una alerta (se llama sólo al mostrarla)."""
+    cfg = CONFIG_HOJAS[kpi_key]
+    desc = cfg['desc']
+    fmt_val = f"{valor:.1%}" if cfg['is_pct'] else f"{valor:.1f}"
+
+    if severidad == SEV_CRITICO:
+        if es_estrella: return f"🌟❌ **{kpi_key} (Estrella)**: {desc} CRÍTICO ({fmt_val})"
+        return f"❌ **{kpi_key}**: {desc} Crítico ({fmt_val})"
+    if severidad == SEV_ATENCION:
+        if es_estrella: return f"🌟⚠️ **{kpi_key} (Estrella)**: {desc} Recuperando ({fmt_val})"
+        return f"⚠️ **{kpi_key}**: {desc} Recuperando/Estancado ({fmt_val})"
+
+    etiqueta = ETIQUETAS_ANOMALIA[ANOM_ATIPICO if severidad == SEV_ATIPICO else ANOM_CAMBIO_NIVEL]
+    return f"📍 **{kpi_key}**: {etiqueta} en {fecha.strftime(FMT_PERIODO)} ({fmt_val})"
+
+def textos_alertas(df_alertas, clientes=None):
+    """Dict Cliente -> lista de textos, sólo para los clientes pedidos (orden original)."""
+    if clientes is not None:
+        df_alertas = df_alertas[df_alertas['Client'].isin(clientes)]
+    textos = {}
+    for cli, kpi, sev, estrella, val, fecha in df_alertas[COLS_ALERTAS].itertuples(index=False):
+        textos.setdefault(cli, []).append(formatear_alerta(kpi, sev, estrella, val, fecha))
+    return textos
+
+# ==========================================
+# DETECCIÓN DE ANOMALÍAS (TODAS LAS SERIES CLIENTE x KPI)
+# ==========================================
+
+def _cubo_series(df_hist, kpis):
+    """
+    Apila df_hist en un arreglo (Cliente, KPI, Período) sin loops por serie.
+    Retorna: (cubo, códigos de cliente por fila, códigos de fecha por fila, clientes, fechas)
+    """
+    cod_cli, clientes = pd.factorize(df_hist['Client'], sort=True)
+    cod_fecha, fechas = pd.factorize(df_hist['Date_Obj'], sort=True)
+    cubo = np.zeros((len(clientes), len(kpis), len(fechas)))
+    cubo[cod_cli, :, cod_fecha] = df_hist[kpis].to_numpy(dtype=float)
+    return cubo, cod_cli, cod_fecha, clientes, fechas
+
+def _escala_robusta(desvios):
+    """
+    Escala (~desvío estándar) a partir de desvíos respecto de la mediana: el mayor entre MAD
+    y desviación absoluta media. Con ventanas cortas el MAD solo subestima seguido el ruido
+    (y dispara falsos atípicos); la media de desvíos es más estable.
+    """
+    return np.maximum(np.median(desvios, axis=-1) / 0.6745, 1.2533 * desvios.mean(axis=-1))
+
+def _zscore_robusto(cubo, ventana, escala_min_rel=0.0):
+    """
+    z robusto de cada punto contra la mediana/escala de los 'ventana' períodos previos.
+    La escala tiene un piso de escala_min_rel * |mediana| (series casi planas).
+    Series sin variación o con mediana de referencia 0 no se evalúan
+    (serie constante o arranque de actividad, no anomalía).
+    """
+    z = np.zeros_like(cubo)
+    if cubo.shape[-1] <= ventana: return z
+
+    previas = sliding_window_view(cubo, ventana, axis=-1)[..., :-1, :]
+    mediana = np.median(previas, axis=-1)
+    escala = _escala_robusta(np.abs(previas - mediana[..., None]))
+    evaluable = (escala > 0) & (mediana != 0)
+    escala = np.maximum(escala, escala_min_rel * np.abs(mediana))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_val = (cubo[..., ventana:] - mediana) / escala
+    z[..., ventana:] = np.where(evaluable, z_val, 0.0)
+    return z
+
+def _cambio_nivel(cubo, antes_n, despues_n, cambio_min, sigmas):
+    """
+    Marca el primer período de un cambio de nivel sostenido: compara la mediana de los
+    'antes_n' períodos previos vs los 'despues_n' siguientes. El salto debe superar
+    'sigmas' errores estándar (ruido estimado sobre ambas mitades juntas) y cambio_min relativo.
+    Entre candidatos vecinos se conserva el de mayor salto de medias (supresión de no-máximos).
+    """
+    n_per = cubo.shape[-1]
+    marca = np.zeros(cubo.shape, dtype=bool)
+    if n_per < antes_n + despues_n: return marca
+
+    ventanas = sliding_window_view(cubo, antes_n + despues_n, axis=-1)
+    antes, despues = ventanas[..., :antes_n], ventanas[..., antes_n:]
+    med_antes = np.median(antes, axis=-1)
+    med_despues = np.median(despues, axis=-1)
+    residuos = np.concatenate([antes - med_antes[..., None], despues - med_despues[..., None]], axis=-1)
+    error_std = _escala_robusta(np.abs(residuos)) * np.sqrt(1 / antes_n + 1 / despues_n)
+    salto = np.abs(med_despues - med_antes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relativo = np.where(med_antes != 0, salto / np.abs(med_antes), 0.0)
+        media_antes = antes.mean(axis=-1)
+        rel_medias = np.abs(despues.mean(axis=-1) - media_antes) / np.abs(media_antes)
+    candidato = (med_antes != 0) & (relativo >= cambio_min) & (salto > sigmas * error_std)
+
+    score = np.where(candidato, rel_medias, -np.inf)
+    vecino = np.full(score.shape[:-1] + (1,), -np.inf)
+    previo = np.concatenate([vecino, score[..., :-1]], axis=-1)
+    siguiente = np.concatenate([score[..., 1:], vecino], axis=-1)
+    marca[..., antes_n:n_per - despues_n + 1] = candidato & (score >= previo) & (score > siguiente)
+    return marca
+
+def detectar_anomalias(df_hist):
+    """
+    Corre z robusto (mediana/escala robusta) y cambio de nivel sobre todas las series Cliente x KPI
+    a la vez, usando ventanas deslizantes (strided views) sobre el cubo de datos.
+    Retorna: (df_hist con columnas Anom_<KPI> [0=ninguna, 1=atípico, 2=cambio de nivel],
+              tabla de alertas con las anomalías de los últimos períodos)
+    """
+    cfgs = {cfg['kpi']: key for key, cfg in CONFIG_HOJAS.items() if cfg['kpi'] in df_hist.columns}
+    kpis = list(cfgs)
+    if df_hist.empty or not kpis:
+        return df_hist, tabla_alertas([], [], [], [], [])
+
+    cubo, cod_cli, cod_fecha, clientes, fechas = _cubo_series(df_hist, kpis)
+    cfg_anom = CONFIG_ANOMALIAS
+
+    atipico = np.abs(_zscore_robusto(cubo, cfg_anom['ventana'], cfg_anom['escala_min_rel'])) >= cfg_anom['z_umbral']
+    cambio = _cambio_nivel(cubo, cfg_anom['nivel_antes'], cfg_anom['nivel_despues'],
+                           cfg_anom['cambio_min'], cfg_anom['nivel_sigmas'])
+
+    # Tras un cambio de nivel, los puntos siguientes "parecen" atípicos vs la ventana vieja: se ignoran.
+    post_cambio = np.zeros_like(cambio)
+    for d in range(1, CONFIG_ANOMALIAS['ventana']):
+        post_cambio[..., d:] |= cambio[..., :-d]
+    atipico &= ~post_cambio
+
+    flags = np.where(cambio, ANOM_CAMBIO_NIVEL, np.where(atipico, ANOM_ATIPICO, ANOM_NINGUNA)).astype(np.int8)
+
+    # Volver a filas de df_hist
+    df_hist = df_hist.copy()
+    por_fila = flags[cod_cli, :, cod_fecha]
+    for i, kpi in enumerate(kpis):
+        df_hist[f"Anom_{kpi}"] = por_fila[:, i]
+
+    # Alertas: sólo los últimos períodos
+    desde = max(0, len(fechas) - CONFIG_ANOMALIAS['periodos_alerta'])
+    ci, ki, ti = np.nonzero(flags[..., desde:])
+    ti = ti + desde
+    claves = np.array([cfgs[k] for k in kpis], dtype=object)
+    sev_por_flag = np.zeros(max(SEV_POR_ANOMALIA) + 1, dtype=np.int8)
+    sev_por_flag[list(SEV_POR_ANOMALIA)] = list(SEV_POR_ANOMALIA.values())
+    severidad = sev_por_flag[flags[ci, ki, ti]]
+    alertas = tabla_alertas(clientes.to_numpy()[ci], claves[ki], severidad, np.zeros(len(ci), dtype=bool),
+                            cubo[ci, ki, ti], fechas[ti])
+    return df_hist, alertas
+
+# ==========================================
+# PROYECCIÓN PRÓXIMO PERÍODO (AJUSTE EN LOTE)
+# ==========================================
+def _columna_numerica(df, col, defecto):
+    """Columna como float (valores no numéricos o faltantes -> defecto)."""
+    if col not in df.columns:
+        return np.full(len(df), defecto, dtype=float)
+    return pd.to_numeric(df[col], errors='coerce').fillna(defecto).to_numpy(dtype=float)
+
+def _cdf_normal(z):
+    """
+    CDF normal estándar sobre arreglos completos (sin loop en Python).
+    erf por Abramowitz & Stegun 7.1.26 (error absoluto < 1.5e-7).
+    """
+    z = np.asarray(z, dtype=float)
+    x = np.abs(z) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poli = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poli * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * erf)
+
+def proyectar_siguiente_periodo(df_hist, df_resumen):
+    """
+    Ajusta una tendencia lineal amortiguada sobre los últimos períodos de TODAS las series
+    Cliente x KPI como un único problema de mínimos cuadrados (una matriz de diseño, muchas Y).
+    Agrega a df_resumen: Proy_<KPI> (valor esperado) y Prob_Fallo_<KPI> (probabilidad de no
+    cumplir la meta: Goal si existe, si no el estándar; Transacciones sólo contra Goal).
+    """
+    cfgs = [(key, cfg) for key, cfg in CONFIG_HOJAS.items() if cfg['kpi'] in df_hist.columns]
+    kpis = [cfg['kpi'] for _, cfg in cfgs]
+    if df_hist.empty or not kpis:
+        return df_resumen
+
+    cubo, _, _, clientes, _ = _cubo_series(df_hist, kpis)
+    n = min(CONFIG_PROYECCION['ventana'], cubo.shape[-1])
+    if n < 3:
+        return df_resumen
+
+    # Mínimos cuadrados en lote: X (n x 2) compartida, Y (n x series)
+    y = cubo[..., -n:].reshape(-1, n).T
+    x = np.arange(n, dtype=float)
+    diseno = np.column_stack([np.ones(n), x])
+    coef = np.linalg.lstsq(diseno, y, rcond=None)[0]
+    residuo = y - diseno @ coef
+    sigma = np.sqrt((residuo ** 2).sum(axis=0) / (n - 2))
+
+    phi = CONFIG_PROYECCION['amortiguacion']
+    proy = (diseno[-1] @ coef) + phi * coef[1]
+    x_nuevo = (n - 1) + phi
+    desvio = sigma * np.sqrt(1 + 1 / n + (x_nuevo - x.mean()) ** 2 / ((x - x.mean()) ** 2).sum())
+
+    proy = proy.reshape(len(clientes), len(kpis))
+    desvio = desvio.reshape(len(clientes), len(kpis))
+
+    # Alinear con las filas de df_resumen
+    pos = clientes.get_indexer(df_resumen['Client'])
+    proy, desvio = proy[pos], desvio[pos]
+
+    nuevas = {}
+    for i, (key, cfg) in enumerate(cfgs):
+        goal = _columna_numerica(df_resumen, cfg['goal_col'], np.nan)
+        if cfg['kpi'] != 'Transacciones':
+            goal = np.where(np.isnan(goal), cfg.get('std', 0), goal)
+        prio = _columna_numerica(df_resumen, cfg.get('prio_col', ''), 2.0)
+        meta = np.where(prio == 0, np.nan, goal)
+
+        # Distancia a la meta en desvíos (positivo = del lado que falla)
+        brecha = (meta - proy[:, i]) if cfg.get('mayor_mejor', True) else (proy[:, i] - meta)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prob = np.where(desvio[:, i] > 0, _cdf_normal(np.nan_to_num(brecha / desvio[:, i])), (brecha > 0).astype(float))
+        prob = np.where(np.isnan(meta), np.nan, prob)
+
+        valor = np.clip(proy[:, i], 0, 1 if cfg['is_pct'] else None)
+        nuevas[f"Proy_{cfg['kpi']}"] = valor
+        nuevas[f"Prob_Fallo_{cfg['kpi']}"] = prob
+
+    return pd.concat([df_resumen, pd.DataFrame(nuevas, index=df_resumen.index)], axis=1)
+
+def texto_proyeccion(row, kpi_config):
+    """Texto corto para tarjetas: 'Próx.: 1.250 · 72% riesgo de fallar meta'."""
+    kpi = kpi_config['kpi']
+    val = row.get(f"Proy_{kpi}", np.nan)
+    if pd.isna(val):
+        return ""
+    fmt_val = f"{val:.0%}" if kpi_config['is_pct'] else f"{val:,.0f}".replace(",", ".")
+    prob = row.get(f"Prob_Fallo_{kpi}", np.nan)
+    if pd.isna(prob):
+        return f"Próx.: {fmt_val}"
+    return f"Próx.: {fmt_val} · {prob:.0%} riesgo de fallar meta"
+
 # ==========================================
 # FASE 2: EVALUACIÓN DINÁMICA (CON PRIORIDADES)
 # ==========================================
@@ -85,9 +467,14 @@ def evaluar_cumplimiento_dinamico(row_cliente, df_historia_cliente, kpi_config):
     val_actual = row_cliente[kpi]
     val_goal = row_cliente.get(goal_col, np.nan)
     
-    # Tendencia
-    if not df_historia_cliente.empty:
-        serie_historia = df_historia_cliente.sort_values('Date_Obj')[kpi]
+    # Tendencia (precalculada en lote por el ETL si existe la columna Pendiente_<KPI>)
+    pendiente_lote = row_cliente.get(f"Pendiente_{kpi}", np.nan)
+    if pd.notna(pendiente_lote):
+        pendiente = pendiente_lote
+    elif not df_historia_cliente.empty:
+        if not df_historia_cliente['Date_Obj'].is_monotonic_increasing:
+            df_historia_cliente = df_historia_cliente.sort_values('Date_Obj')
+        serie_historia = df_historia_cliente[kpi]
         pendiente = calcular_direccion_tendencia(serie_historia)
     else:
         pendiente = 0
@@ -147,81 +534,93 @@ def evaluar_cumplimiento_dinamico(row_cliente, df_historia_cliente, kpi_config):
     return f"Tendencia {flecha}", "Informativo", "off", 0
 
 # ==========================================
-# FASE 3: DIAGNÓSTICO INTEGRAL (ACTUALIZADO)
+# FASE 3: DIAGNÓSTICO INTEGRAL (EN LOTE)
 # ==========================================
-def generar_diagnostico_cliente(row, df_historia_cliente):
+def _scores_kpi(df_resumen, cfg):
+    """
+    Versión en lote del score de evaluar_cumplimiento_dinamico para toda la cartera.
+    Retorna: (score [-1/0/1], prioridad) por fila.
+    """
+    kpi = cfg['kpi']
+    prio = _columna_numerica(df_resumen, cfg.get('prio_col', ''), 2.0)
+    val = df_resumen[kpi].to_numpy(dtype=float)
+    goal = _columna_numerica(df_resumen, cfg['goal_col'], np.nan)
+    pendiente = _columna_numerica(df_resumen, f"Pendiente_{kpi}", 0.0)
+
+    umb_slope = 0.001
+    if cfg.get('mayor_mejor', True):
+        mejorando = pendiente > umb_slope
+    else:
+        mejorando = pendiente < -umb_slope
+
+    def score_vs(cumple):
+        # Cumple -> 1 | Estrella que falla -> -1 | Mejorando -> 0 | Empeora / Estancado -> -1
+        return np.where(cumple, 1, np.where((prio != 3) & mejorando, 0, -1))
+
+    tiene_goal = ~np.isnan(goal)
+    if kpi == 'Transacciones':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            alcance = np.where(goal > 0, val / goal, 0.0)
+        tendencia = df_resumen.get('Tendencia_Trx', pd.Series('N/A', index=df_resumen.index)).astype(str)
+        sin_goal = np.where(tendencia.str.contains('Crecimiento').to_numpy(), 1,
+                            np.where(tendencia.str.contains('Riesgo').to_numpy(), -1, 0))
+        score = np.where(tiene_goal, score_vs(alcance >= 1.0), sin_goal)
+    else:
+        meta = np.where(tiene_goal, goal, cfg.get('std', 0))
+        cumple = val >= meta if cfg.get('mayor_mejor', True) else val <= meta
+        score = score_vs(cumple)
+
+    return np.where(prio == 0, 0, score), prio
+
+def generar_diagnostico_cartera(df_resumen):
     """
-    Genera el estado de salud y la lista de alertas.
+    Genera estado de salud y alertas de TODOS los clientes en una pasada por KPI.
     - Prioridad 0: Se ignora.
     - Prioridad 3: Si falla, fuerza estado CRÍTICO.
+    Retorna: (Estado_Cod int8, Motivo_Cod int8, N_Alertas int16, tabla de alertas)
     """
-    alertas = []
-    fallo_estrella = False # Nueva bandera
-    
-    # Prioridades para lógica Churn específica
-    trx_prio = float(row.get('Prio_Transacciones', 2)) if pd.notna(row.get('Prio_Transacciones')) else 2.0
-    dac_prio = float(row.get('Prio_DAC', 2)) if pd.notna(row.get('Prio_DAC')) else 2.0
-    
+    n = len(df_resumen)
+    clientes = df_resumen['Client'].to_numpy()
+    n_alertas = np.zeros(n, dtype=np.int16)
+    n_rojas = np.zeros(n, dtype=np.int16)
+    fallo_estrella = np.zeros(n, dtype=bool)
+    scores = {}
+    bloques = []
+
     for key, cfg in CONFIG_HOJAS.items():
-        _, _, color, score = evaluar_cumplimiento_dinamico(row, df_historia_cliente, cfg)
-        
-        # 1. FILTRAR IRRELEVANTES (Prioridad 0)
-        if color == 'secondary':
-            continue
-            
-        desc = cfg['desc']
-        val = row[cfg['kpi']]
-        fmt_val = f"{val:.1%}" if cfg['is_pct'] else f"{val:.1f}"
-        
-        # Obtenemos la prioridad de ESTE kpi actual
-        prio_kpi_col = cfg.get('prio_col', '')
-        try:
-            kpi_prio = float(row.get(prio_kpi_col, 2)) if pd.notna(row.get(prio_kpi_col)) else 2.0
-        except: kpi_prio = 2.0
-
-        # 2. GENERAR ALERTAS
-        if score == -1: 
-            # Si es Estrella (3) y falla, marcamos la bandera de gravedad máxima
-            if kpi_prio == 3:
-                fallo_estrella = True
-                alertas.append(f"🌟❌ **{key} (Estrella)**: {desc} CRÍTICO ({fmt_val})")
-            else:
-                alertas.append(f"❌ **{key}**: {desc} Crítico ({fmt_val})")
-                
-        elif score == 0: 
-            if kpi_prio == 3:
-                alertas.append(f"🌟⚠️ **{key} (Estrella)**: {desc} Recuperando ({fmt_val})")
-            else:
-                alertas.append(f"⚠️ **{key}**: {desc} Recuperando/Estancado ({fmt_val})")
-            
-    n_alertas_rojas = sum(1 for a in alertas if "❌" in a)
-    
-    # 3. LÓGICA DE ESTADO (Buckets)
-    
+        if cfg['kpi'] not in df_resumen.columns: continue
+        score, prio = _scores_kpi(df_resumen, cfg)
+        scores[key] = (score, prio)
+
+        relevante = prio != 0
+        alerta = relevante & (score <= 0)
+        roja = relevante & (score == -1)
+        estrella = prio == 3
+        n_alertas += alerta
+        n_rojas += roja
+        fallo_estrella |= roja & estrella
+
+        filas = np.nonzero(alerta)[0]
+        bloques.append(pd.DataFrame({
+            'fila': filas, 'KPI': key,
+            'Severidad': np.where(score[filas] == -1, SEV_CRITICO, SEV_ATENCION),
+            'Es_Estrella': estrella[filas],
+            'Valor': df_resumen[cfg['kpi']].to_numpy(dtype=float)[filas],
+        }))
+
     # Riesgo Churn Clásico (Volumen + Quejas)
-    es_critico_churn = False
-    motivo_critico = ""
-    
-    trx_stat = evaluar_cumplimiento_dinamico(row, df_historia_cliente, CONFIG_HOJAS['Transacciones'])
-    dac_stat = evaluar_cumplimiento_dinamico(row, df_historia_cliente, CONFIG_HOJAS['DAC'])
-    
-    if trx_prio > 0 and dac_prio > 0:
-        if trx_stat[3] == -1 and dac_stat[3] == -1:
-            es_critico_churn = True
-            motivo_critico = "🚨 ALERTA CHURN: Caída de volumen crítica + Insatisfacción."
+    churn = np.zeros(n, dtype=bool)
+    if 'Transacciones' in scores and 'DAC' in scores:
+        (trx_score, trx_prio), (dac_score, dac_prio) = scores['Transacciones'], scores['DAC']
+        churn = (trx_prio > 0) & (dac_prio > 0) & (trx_score == -1) & (dac_score == -1)
 
     # --- REGLAS DE CLASIFICACIÓN FINAL ---
-    if es_critico_churn:
-        estado = "Crítico / Riesgo"
-    elif fallo_estrella: 
-        # Si falla una estrella, es crítico automáticamente
-        estado = "Crítico / Riesgo"
-        if not motivo_critico: motivo_critico = "Fallo en KPI Estrella (Prioridad 3)."
-    elif n_alertas_rojas >= 3: 
-        estado = "Revisión Profunda"
-    elif len(alertas) >= 1: 
-        estado = "Atención Operativa"
-    else: 
-        estado = "Saludable / Campeón 🏆"
-    
-    return estado, alertas, motivo_critico
\ No newline at end of file
+    estado = np.select([churn | fallo_estrella, n_rojas >= 3, n_alertas >= 1],
+                       [ESTADO_CRITICO, ESTADO_REVISION, ESTADO_ATENCION], ESTADO_SALUDABLE).astype(np.int8)
+    motivo = np.select([churn, fallo_estrella], [MOTIVO_CHURN, MOTIVO_ESTRELLA], MOTIVO_NINGUNO).astype(np.int8)
+
+    # Orden igual al de siempre: por cliente, KPIs en el orden de CONFIG_HOJAS
+    df = pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame(columns=['fila', 'KPI', 'Severidad', 'Es_Estrella', 'Valor'])
+    df = df.sort_values('fila', kind='stable')
+    alertas = tabla_alertas(clientes[df['fila'].to_numpy(dtype=int)], df['KPI'], df['Severidad'], df['Es_Estrella'], df['Valor'])
+    return estado, motivo, n_alertas, alertas
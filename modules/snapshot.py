@@ -0,0 +1,87 @@
+# modules/snapshot.py
+# Persistencia local del último resultado válido del ETL (Last-Known-Good).
+# Este módulo es deliberadamente liviano: no importa streamlit ni la lógica,
+# así la app puede mostrar datos apenas arranca, antes de que termine la descarga.
+import os
+import pickle
+import hashlib
+import tempfile
+from datetime import datetime
+from modules.config import SNAPSHOT_DIR, SNAPSHOT_FILE
+
+
+def ruta_snapshot():
+    return os.path.join(SNAPSHOT_DIR, SNAPSHOT_FILE)
+
+
+def marca_snapshot():
+    """
+    Marca barata (mtime en ns) para saber si hay un snapshot más nuevo en disco.
+    Retorna None si todavía no existe ninguno.
+    """
+    try:
+        return os.stat(ruta_snapshot()).st_mtime_ns
+    except OSError:
+        return None
+
+
+def guardar_snapshot(df_hist, df_resumen, df_alertas, log=None, generado=None):
+    """
+    Guarda el resultado del ETL de forma atómica (archivo temporal + rename).
+    La 'version' es un hash del contenido: si los datos no cambian, la versión tampoco.
+    'generado' es el momento en que se descargaron los datos (por defecto, ahora).
+    """
+    datos = pickle.dumps((df_hist, df_resumen, df_alertas), protocol=pickle.HIGHEST_PROTOCOL)
+    version = hashlib.sha1(datos).hexdigest()[:16]
+    payload = {
+        'version': version,
+        'generado': generado or datetime.now(),
+        'log': list(log or []),
+        'datos': datos,
+    }
+
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, ruta_snapshot())
+    except Exception:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    return version
+
+
+def cargar_snapshot():
+    """
+    Lee el snapshot de disco.
+    Retorna: dict con hist, resumen, alertas, version, generado, log y marca;
+    o None si no hay (o está corrupto / en un formato anterior).
+    """
+    ruta = ruta_snapshot()
+    try:
+        marca = os.stat(ruta).st_mtime_ns
+        with open(ruta, 'rb') as f:
+            payload = pickle.load(f)
+        df_hist, df_resumen, df_alertas = pickle.loads(payload['datos'])
+    except Exception:
+        return None
+
+    return {
+        'hist': df_hist,
+        'resumen': df_resumen,
+        'alertas': df_alertas,
+        'version': payload['version'],
+        'generado': payload['generado'],
+        'log': payload.get('log', []),
+        'marca': marca,
+    }
+
+
+def formatear_antiguedad(generado, ahora=None):
+    """Texto amigable con la edad de los datos (ej: 'hace 5 min')."""
+    segundos = max(0, ((ahora or datetime.now()) - generado).total_seconds())
+    if segundos < 60: return "hace instantes"
+    if segundos < 3600: return f"hace {segundos // 60:.0f} min"
+    if segundos < 86400: return f"hace {segundos // 3600:.0f} h"
+    return f"hace {segundos // 86400:.0f} días"